@@ -1,17 +1,33 @@
 import sqlite3
-import json
+import orjson
 import os
-import pandas as pd
+from pathlib import Path
+
+def normalize_tag_cell(value):
+    """Normalize a DCF tag cell for matching: decode bytes, str() and lowercase (no strip)."""
+    if value is None:
+        return None
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode("utf-8", errors="replace")
+    return str(value).lower()
 
 def identify_tag_properties(dcf_path, flow_json_path, output_dir="output_analysis"):
     os.makedirs(output_dir, exist_ok=True)
 
     # Load the flow JSON
-    with open(flow_json_path, "r", encoding="utf-8") as f:
-        flow_data = json.load(f)
+    flow_data = orjson.loads(Path(flow_json_path).read_bytes())
+
+    # Collect every distinct tag referenced by the flows up front
+    wanted_tags = set()
+    for details in flow_data.values():
+        for conn_item in details.get("all_connections", []):
+            wanted_tags.add(str(conn_item.get("from")).strip().lower())
+            wanted_tags.add(str(conn_item.get("to")).strip().lower())
 
     # Connect to DCF file
     conn = sqlite3.connect(dcf_path)
+    # SQLite's own lower() only folds ASCII, so the DB side goes through Python's str.lower() like the flow side
+    conn.create_function("py_norm", 1, normalize_tag_cell, deterministic=True)
     cursor = conn.cursor()
 
     # Get all tables except pipelines
@@ -22,44 +38,68 @@ def identify_tag_properties(dcf_path, flow_json_path, output_dir="output_analysi
     print(f"✅ Found {len(non_pipeline_tables)} non-pipeline tables.")
     print(f"🔍 Checking tags against these tables:\n{non_pipeline_tables}\n")
 
-    # Load each table as a DataFrame
-    table_data = {}
+    # Stage the wanted tags in a temp table so SQLite does the matching;
+    # the DCF itself is only read, never indexed or altered.
+    # WITHOUT ROWID stores the tags in their primary-key B-tree, so each probe is one lookup
+    cursor.execute("CREATE TEMP TABLE tags (t TEXT PRIMARY KEY) WITHOUT ROWID;")
+    cursor.executemany("INSERT INTO tags (t) VALUES (?);", [(t,) for t in wanted_tags])
+
+    # Build a tag index once: normalized tag -> ready-made tag info
+    tag_index = {}
     for table in non_pipeline_tables:
         try:
-            df = pd.read_sql_query(f"SELECT * FROM '{table}';", conn)
-            # Decode bytes if needed
-            for col in df.columns:
-                if df[col].dtype == object:
-                    df[col] = df[col].apply(lambda x: x.decode('utf-8', errors='replace')
-                                            if isinstance(x, (bytes, bytearray)) else x)
-            table_data[table] = df
+            cursor.execute(f"PRAGMA table_info('{table}');")
+            tag_cols = [row[1] for row in cursor.fetchall() if "tag" in row[1].lower()]
+            if not tag_cols:
+                continue
+
+            # Categorize
+            if "equip" in table.lower():
+                cat = "equipment"
+            elif "instr" in table.lower():
+                cat = "instrumentation"
+            elif "valve" in table.lower():
+                cat = "handvalve"
+            else:
+                cat = "node"
+
+            for col in tag_cols:
+                # Only rows whose tag is actually referenced come back, and
+                # only the tag column is read while matching
+                cursor.execute(
+                    f"SELECT tags.t, x.rowid FROM '{table}' AS x "
+                    f"JOIN tags ON tags.t = py_norm(x.\"{col}\") "
+                    f"ORDER BY x.rowid;"
+                )
+                winners = {}
+                for key, rowid in cursor.fetchall():
+                    # First table/column/row wins, same as the old sequential scan
+                    if key not in tag_index and key not in winners:
+                        winners[key] = rowid
+
+                # Full rows are fetched by rowid for the winning matches only
+                for key, rowid in winners.items():
+                    cursor.execute(f"SELECT * FROM '{table}' WHERE rowid = ?;", (rowid,))
+                    columns = [d[0] for d in cursor.description]
+                    # Decode bytes if needed
+                    record = {
+                        c: v.decode("utf-8", errors="replace") if isinstance(v, (bytes, bytearray)) else v
+                        for c, v in zip(columns, cursor.fetchone())
+                    }
+                    tag_index[key] = {"category": cat, "table": table, "properties": record}
+
+                # Resolved tags don't need to be matched against later tables
+                cursor.executemany("DELETE FROM tags WHERE t = ?;", [(key,) for key in winners])
         except Exception as e:
             print(f"⚠️ Skipping table {table}: {e}")
 
     conn.close()
 
     # Helper to find a tag across tables
+    not_found = {"category": "node", "table": None, "properties": None}
+
     def find_tag_info(tag):
-        tag_str = str(tag).strip().lower()
-        for table, df in table_data.items():
-            # Check in 'Tag' or similar columns
-            for col in df.columns:
-                if "tag" in col.lower():
-                    matches = df[df[col].astype(str).str.lower() == tag_str]
-                    if not matches.empty:
-                        record = matches.iloc[0].to_dict()
-                        # Categorize
-                        if "equip" in table.lower():
-                            cat = "equipment"
-                        elif "instr" in table.lower():
-                            cat = "instrumentation"
-                        elif "valve" in table.lower():
-                            cat = "handvalve"
-                        else:
-                            cat = "node"
-                        return {"category": cat, "table": table, "properties": record}
-        # Not found
-        return {"category": "node", "table": None, "properties": None}
+        return tag_index.get(str(tag).strip().lower(), not_found)
 
     # Iterate through each flow and verify tags
     verification_results = {}
@@ -90,8 +130,8 @@ def identify_tag_properties(dcf_path, flow_json_path, output_dir="output_analysi
 
     # Save results
     json_out = os.path.join(output_dir, "pipeline_tag_verification.json")
-    with open(json_out, "w", encoding="utf-8") as f:
-        json.dump(verification_results, f, ensure_ascii=False, indent=2)
+    with open(json_out, "wb") as f:
+        f.write(orjson.dumps(verification_results, option=orjson.OPT_INDENT_2))
 
     print(f"\n✅ Verification completed. Output saved to: {json_out}")
     print(f"✅ Total pipelines processed: {len(verification_results)}")
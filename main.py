@@ -1,8 +1,11 @@
 import streamlit as st
-import json
+import orjson
 import re
 import os
-from difflib import SequenceMatcher
+import ahocorasick
+from collections import defaultdict
+from pathlib import Path
+from rapidfuzz import fuzz, process
 from dotenv import load_dotenv
 from openai import OpenAI  # new-style OpenAI client
 
@@ -29,13 +32,19 @@ client = OpenAI(api_key=api_key)
 # ==========================
 # Load JSON Data
 # ==========================
+def load_data(path):
+    """Parse the plant JSON; re-read on every rerun so a regenerated file is picked up."""
+    return orjson.loads(Path(path).read_bytes())
+
+
 try:
-    with open("classified_pipeline_tags2.json", "r", encoding="utf-8") as f:
-        DATA = json.load(f)
+    DATA = load_data("classified_pipeline_tags2.json")
+    # Part of the query cache key, so cached answers are dropped when the file is regenerated
+    DATA_VERSION = os.stat("classified_pipeline_tags2.json").st_mtime_ns
 except FileNotFoundError:
     st.error("❌ 'classified_pipeline_tags2.json' not found in the app directory.")
     st.stop()
-except json.JSONDecodeError:
+except orjson.JSONDecodeError:
     st.error(
         "❌ 'classified_pipeline_tags2.json' is not valid JSON. "
         "Make sure it is generated correctly and committed."
@@ -48,44 +57,46 @@ PROCESS_DATA = DATA.get("process_data", {})
 # ==========================
 # Helper Functions
 # ==========================
+# Translation table deleting every ASCII character that isn't a letter or digit
+_NON_ALNUM_RE = re.compile(r"[^a-zA-Z0-9]")
+
+
 def normalize_tag(tag: str) -> str:
     if not isinstance(tag, str):
         return ""
-    return re.sub(r"[^a-zA-Z0-9]", "", tag).lower()
+    return _NON_ALNUM_RE.sub("", tag).lower()
 
 
-def similarity(a, b):
-    return SequenceMatcher(None, a, b).ratio()
-
-
-def find_best_tag_matches(query, data_list, threshold=0.6):
+# Fuzzy scores below use RapidFuzz's fuzz.ratio, 2*LCS/(len(a)+len(b)). It is never lower than
+# the difflib SequenceMatcher.ratio() the app used before, so some near-miss tags now pass the
+# 0.6 / 0.7 thresholds (e.g. '9ig202' vs '9g0x2o': 0.50 -> 0.67).
+def find_best_tag_matches(query, section, threshold=0.6):
     """
-    Improved matcher:
+    Improved matcher over one process_data section (e.g. "Equipment"):
     - First do simple substring match of Tag in the raw query.
-    - Fallback to fuzzy similarity on normalized strings.
+    - Only if no tag is mentioned, fallback to fuzzy similarity on
+      normalized strings.
+    Uses the indexes precomputed in SECTION_INDEX.
     """
-    results = []
+    data_list = PROCESS_DATA.get(section, [])
     if not data_list:
-        return results
+        return []
 
-    q_raw = query.lower()
-    q_norm = normalize_tag(query)
-
-    for item in data_list:
-        tag = item.get("Tag", "")
-        tag_lower = tag.lower()
-        tag_norm = normalize_tag(tag)
+    automaton, tag_norms = SECTION_INDEX[section]
 
-        # Direct substring match on raw text (strong signal)
-        if tag_lower and tag_lower in q_raw:
-            results.append(item)
-            continue
+    # Direct substring match on raw text (strong signal), one automaton pass
+    if automaton is not None:
+        hits = {i for _, indices in automaton.iter(query.lower()) for i in indices}
+        if hits:
+            return [data_list[i] for i in sorted(hits)]
 
-        # Fuzzy match as backup
-        if tag_norm and similarity(q_norm, tag_norm) >= threshold:
-            results.append(item)
-
-    return results
+    # Fuzzy match as backup, scored in one batch
+    fuzzy_hits = {
+        i for _, _, i in process.extract(
+            normalize_tag(query), tag_norms, scorer=fuzz.ratio, score_cutoff=threshold * 100, limit=None
+        )
+    }
+    return [data_list[i] for i in sorted(fuzzy_hits)]
 
 
 def find_pipeline_matches(query, threshold=0.6):
@@ -98,15 +109,18 @@ def find_pipeline_matches(query, threshold=0.6):
     q_norm = normalize_tag(query)
     matches = {}
 
-    for pipe_tag, pipe_info in PIPELINES.items():
-        tag_lower = pipe_tag.lower()
-        tag_norm = normalize_tag(pipe_tag)
-
-        if tag_lower in q_raw:
-            matches[pipe_tag] = pipe_info
-            continue
+    fuzzy_hits = {
+        pipe_tag for _, _, pipe_tag in process.extract(
+            q_norm,
+            PIPELINE_NORMS,
+            scorer=fuzz.ratio,
+            score_cutoff=threshold * 100,
+            limit=None,
+        )
+    }
 
-        if similarity(q_norm, tag_norm) >= threshold:
+    for pipe_tag, pipe_info in PIPELINES.items():
+        if pipe_tag.lower() in q_raw or pipe_tag in fuzzy_hits:
             matches[pipe_tag] = pipe_info
 
     return matches
@@ -124,47 +138,99 @@ def build_tag_index():
     for anything that has a tag (equipment, instrumentation, handvalves, nodes)
     inside pipeline complete_flows.
     """
-    index = {}
+    index = defaultdict(set)
     for pipe_tag, pipe_info in PIPELINES.items():
-        for step in pipe_info.get("complete_flow", []):
-            step_tag = step.get("tag")
-            details = step.get("details") or {}
-            detail_tag = details.get("Tag")
+        for step in pipe_info.get("complete_flow", ()):
+            for t in (step.get("tag"), (step.get("details") or {}).get("Tag")):
+                if t:
+                    index[normalize_tag(t)].add(pipe_tag)
 
-            for t in {step_tag, detail_tag}:
-                if not t:
-                    continue
-                norm = normalize_tag(t)
-                index.setdefault(norm, set()).add(pipe_tag)
-
-    return index
+    return dict(index)
 
 
 TAG_TO_PIPELINES = build_tag_index()
 
 
-def find_pipelines_for_tag(tag_query: str, threshold: float = 0.7):
+def build_automaton(words):
+    """
+    Build an Aho-Corasick automaton from a {word: value} mapping, so a
+    single scan of a query finds every word it contains.
+    Returns None when there are no words to index.
+    """
+    automaton = ahocorasick.Automaton()
+    for word, value in words.items():
+        if word:
+            automaton.add_word(word, value)
+    if not len(automaton):
+        return None
+    automaton.make_automaton()
+    return automaton
+
+
+TAG_AUTOMATON = build_automaton({t_norm: t_norm for t_norm in TAG_TO_PIPELINES})
+
+
+# ==========================
+# Precomputed Section Indexes
+# ==========================
+def build_section_index(items):
     """
-    Given a tag-like query (e.g. 'hvmkh441' or 'staalname'),
-    return all pipelines that contain that tag anywhere in their flow.
+    Precompute the lookups for a process_data section, so the matchers
+    don't redo this work on every query.
+    Returns (automaton over lowercase tags -> item indices, {index: normalized tag}).
+    """
+    by_lower = {}
+    tag_norms = {}
+    for i, item in enumerate(items):
+        tag = item.get("Tag", "")
+        by_lower.setdefault(tag.lower(), []).append(i)
+        tag_norm = normalize_tag(tag)
+        if tag_norm:
+            tag_norms[i] = tag_norm
+    return build_automaton(by_lower), tag_norms
+
+
+SECTION_INDEX = {
+    section: build_section_index(PROCESS_DATA.get(section, []))
+    for section in ["Equipment", "Instrumentation", "HandValves"]
+}
+PIPELINE_NORMS = {pipe_tag: normalize_tag(pipe_tag) for pipe_tag in PIPELINES}
+
+
+def find_pipelines_for_tags(tag_queries, threshold: float = 0.7):
+    """
+    Given tag-like queries (e.g. 'hvmkh441' or 'staalname'),
+    return all pipelines that contain any of those tags anywhere in their flow.
+    All queries are handled in one lookup over TAG_TO_PIPELINES.
     """
     results = {}
-    if not tag_query:
-        return results
 
-    q_norm = normalize_tag(tag_query)
-    if not q_norm:
+    # Normalized, non-empty, de-duplicated queries
+    q_norms = list(dict.fromkeys(q for q in map(normalize_tag, tag_queries) if q))
+    if not q_norms:
         return results
 
     # 1) direct hit
-    direct = TAG_TO_PIPELINES.get(q_norm, set())
-    for p_tag in direct:
-        if p_tag in PIPELINES:
-            results[p_tag] = PIPELINES[p_tag]
+    for q_norm in q_norms:
+        for p_tag in TAG_TO_PIPELINES.get(q_norm, set()):
+            if p_tag in PIPELINES:
+                results[p_tag] = PIPELINES[p_tag]
 
     # 2) fuzzy / partial hit
+    # tags contained in any query, found in one pass; normalized tags are
+    # alphanumeric, so the space keeps matches from spanning two queries
+    contained = set()
+    if TAG_AUTOMATON is not None:
+        contained = {t_norm for _, t_norm in TAG_AUTOMATON.iter(" ".join(q_norms))}
+    fuzzy_hits = set()
+    for q_norm in q_norms:
+        fuzzy_hits.update(
+            t_norm for t_norm, _, _ in process.extract(
+                q_norm, TAG_TO_PIPELINES.keys(), scorer=fuzz.ratio, score_cutoff=threshold * 100, limit=None
+            )
+        )
     for t_norm, pipe_ids in TAG_TO_PIPELINES.items():
-        if t_norm in q_norm or q_norm in t_norm or similarity(q_norm, t_norm) >= threshold:
+        if t_norm in contained or t_norm in fuzzy_hits or any(q_norm in t_norm for q_norm in q_norms):
             for p_tag in pipe_ids:
                 if p_tag in PIPELINES:
                     results[p_tag] = PIPELINES[p_tag]
@@ -186,37 +252,29 @@ def build_local_context(query):
 
     # General category queries
     if any(word in q for word in ["pipeline", "line", "flow path", "pipe"]):
-        context["pipelines"] = PIPELINES
+        context["pipelines"] = dict(PIPELINES)
     elif any(word in q for word in ["equipment", "pump", "tank", "vessel", "reactor"]):
-        context["equipment"] = PROCESS_DATA.get("Equipment", [])
+        context["equipment"] = list(PROCESS_DATA.get("Equipment", []))
     elif any(word in q for word in ["instrument", "valve", "controller", "sensor"]):
-        context["instrumentation"] = PROCESS_DATA.get("Instrumentation", [])
-        context["handvalves"] = PROCESS_DATA.get("HandValves", [])
+        context["instrumentation"] = list(PROCESS_DATA.get("Instrumentation", []))
+        context["handvalves"] = list(PROCESS_DATA.get("HandValves", []))
     else:
         # Specific tag / free-text search
-        context["equipment"] = find_best_tag_matches(
-            query, PROCESS_DATA.get("Equipment", [])
-        )
-        context["instrumentation"] = find_best_tag_matches(
-            query, PROCESS_DATA.get("Instrumentation", [])
-        )
-        context["handvalves"] = find_best_tag_matches(
-            query, PROCESS_DATA.get("HandValves", [])
-        )
+        context["equipment"] = find_best_tag_matches(query, "Equipment")
+        context["instrumentation"] = find_best_tag_matches(query, "Instrumentation")
+        context["handvalves"] = find_best_tag_matches(query, "HandValves")
         # Match by pipeline tag
         context["pipelines"] = find_pipeline_matches(query)
 
-    # Also search pipelines that contain the mentioned tags (incl. nodes like 'staalname')
-    extra_pipes = {}
-
-    # 1) try using the raw user query as a tag-like string
-    extra_pipes.update(find_pipelines_for_tag(query))
-
-    # 2) try using any matched equipment / instrumentation / handvalve tags
-    for section in ["equipment", "instrumentation", "handvalves"]:
-        for item in context[section]:
-            t = item.get("Tag", "")
-            extra_pipes.update(find_pipelines_for_tag(t))
+    # Also search pipelines that contain the mentioned tags (incl. nodes like 'staalname'),
+    # using both the raw user query as a tag-like string and any matched
+    # equipment / instrumentation / handvalve tags, in one batched lookup
+    candidate_tags = [query] + [
+        item.get("Tag", "")
+        for section in ["equipment", "instrumentation", "handvalves"]
+        for item in context[section]
+    ]
+    extra_pipes = find_pipelines_for_tags(candidate_tags)
 
     # Merge explicit matches + extra pipes
     if context["pipelines"]:
@@ -280,25 +338,30 @@ def summarize_context(context):
             end = info.get("end", {})
             s_tag = (start.get("details") or {}).get("Tag") or start.get("tag", "unknown")
             e_tag = (end.get("details") or {}).get("Tag") or end.get("tag", "unknown")
-            lines.append(f"- {tag}: from {s_tag} to {e_tag}")
 
-            # Highlight nodes and important tags on this pipeline
-            flow = info.get("complete_flow", [])
-            for step in flow:
+            # Bucket the nodes and important tags on this pipeline by kind,
+            # each tag listed once, then render the pipeline as a single line
+            on_pipeline = {"node": {}, "instrumentation": {}, "handvalve": {}}
+            for step in info.get("complete_flow", []):
+                found = on_pipeline.get(step.get("category"))
+                if found is None:
+                    continue
                 if step.get("category") == "node":
-                    node_tag = step.get("tag", "")
-                    if node_tag:
-                        lines.append(f"  • node '{node_tag}' is present in pipeline {tag}")
-                elif step.get("category") == "instrumentation":
-                    inst_details = step.get("details") or {}
-                    inst_tag = inst_details.get("Tag") or step.get("tag", "")
-                    if inst_tag:
-                        lines.append(f"  • instrumentation '{inst_tag}' is on pipeline {tag}")
-                elif step.get("category") == "handvalve":
-                    hv_details = step.get("details") or {}
-                    hv_tag = hv_details.get("Tag") or step.get("tag", "")
-                    if hv_tag:
-                        lines.append(f"  • handvalve '{hv_tag}' is on pipeline {tag}")
+                    step_tag = step.get("tag", "")
+                else:
+                    step_tag = (step.get("details") or {}).get("Tag") or step.get("tag", "")
+                if step_tag:
+                    found[step_tag] = None
+
+            parts = [f"from {s_tag} to {e_tag}"]
+            for category, label in [
+                ("node", "nodes"),
+                ("instrumentation", "instrumentation"),
+                ("handvalve", "handvalves"),
+            ]:
+                if on_pipeline[category]:
+                    parts.append(f"{label} " + ", ".join(f"'{t}'" for t in on_pipeline[category]))
+            lines.append(f"- {tag}: " + "; ".join(parts))
 
     if not lines:
         return "No matching data found in plant model."
@@ -306,9 +369,30 @@ def summarize_context(context):
     return "\n".join(lines)
 
 
+@st.cache_data(max_entries=256)
+def build_query_context(query, data_version):
+    """
+    Build the summary text for a query plus the tag it refers to
+    (equipment tag first, else the first pipeline; empty list if none).
+    Cached per query and data version; only these two small values are
+    stored, so a cache hit doesn't copy the matched pipelines.
+    """
+    context = build_local_context(query)
+    if context["equipment"]:
+        reference = [context["equipment"][0].get("Tag", None)]
+    elif context["pipelines"]:
+        reference = [next(iter(context["pipelines"]))]
+    else:
+        reference = []
+    return summarize_context(context), reference
+
+
 # ==========================
 # Session State Initialization (MEMORY)
 # ==========================
+# Only the most recent turns are sent to the model (user + assistant = 2 messages per turn)
+MAX_HISTORY_MESSAGES = 20
+
 if "system_message" not in st.session_state:
     st.session_state.system_message = {
         "role": "system",
@@ -365,22 +449,19 @@ if user_input:
     st.session_state.chat_history.append({"role": "user", "content": user_input})
 
     # Build local context for CURRENT question
-    context = build_local_context(user_input)
-    context_text = summarize_context(context)
+    context_text, reference = build_query_context(user_input, DATA_VERSION)
 
     # Track last referenced tag (prefer equipment tag, else first pipeline)
-    if context["equipment"]:
-        st.session_state.last_reference = context["equipment"][0].get("Tag", None)
-    elif context["pipelines"]:
-        st.session_state.last_reference = list(context["pipelines"].keys())[0]
+    if reference:
+        st.session_state.last_reference = reference[0]
 
     # ==========================
     # Prepare messages for the model
-    # MEMORY = entire chat_history is included here
+    # MEMORY = the last MAX_HISTORY_MESSAGES of chat_history are included here
     # ==========================
     messages = (
         [st.session_state.system_message]
-        + st.session_state.chat_history
+        + st.session_state.chat_history[-MAX_HISTORY_MESSAGES:]
         + [
             {
                 "role": "system",
@@ -389,18 +470,26 @@ if user_input:
         ]
     )
 
-    try:
-        # Call OpenAI Chat Completions API
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=messages,
-            temperature=0.25,
-        )
-        reply = response.choices[0].message.content
-    except Exception as e:
-        reply = f"⚠️ Error calling GPT: {str(e)}"
-
-    # Show assistant reply and store in chat_history (MEMORY)
-    st.chat_message("assistant").markdown(reply)
+    # Show assistant reply as it streams in
+    with st.chat_message("assistant"):
+        placeholder = st.empty()
+        reply = ""
+        try:
+            # Call OpenAI Chat Completions API
+            stream = client.chat.completions.create(
+                model="gpt-4o",
+                messages=messages,
+                temperature=0.25,
+                stream=True,
+            )
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    reply += chunk.choices[0].delta.content
+                    placeholder.markdown(reply + "▌")
+        except Exception as e:
+            reply = f"⚠️ Error calling GPT: {str(e)}"
+        placeholder.markdown(reply)
+
+    # Store assistant reply in chat_history (MEMORY)
     st.session_state.chat_history.append({"role": "assistant", "content": reply})
 
@@ -1,7 +1,67 @@
 import sqlite3
-import pandas as pd
-import json
+import csv
+import orjson
 import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+def find_blob_columns(cursor, table):
+    """Return the indices of the columns of table holding at least one BLOB value."""
+    cursor.execute(f"PRAGMA table_info('{table}');")
+    columns = [row[1] for row in cursor.fetchall()]
+    if not columns:
+        return []
+    # One pass inside SQLite; types are per cell, so a sample row wouldn't be enough
+    quoted = ['"' + c.replace('"', '""') + '"' for c in columns]
+    checks = ", ".join(f"max(typeof({q}) = 'blob')" for q in quoted)
+    cursor.execute(f"SELECT {checks} FROM '{table}';")
+    return [i for i, has_blob in enumerate(cursor.fetchone()) if has_blob]
+
+def export_table(dcf_path, table, csv_dir):
+    """
+    Save one table as CSV and return a temporary file holding its rows as a
+    JSON array (or None if the table can't be read). Uses its own connection
+    so several tables can be exported in parallel.
+    """
+    conn = sqlite3.connect(dcf_path)
+    cursor = conn.cursor()
+    fragment = tempfile.TemporaryFile()
+    try:
+        blob_cols = find_blob_columns(cursor, table)
+        cursor.execute(f"SELECT * FROM '{table}';")
+        columns = [d[0] for d in cursor.description]
+
+        fragment.write(b"[")
+        csv_path = os.path.join(csv_dir, f"{table}.csv")
+        with open(csv_path, "w", encoding="utf-8", newline="") as csv_file:
+            writer = csv.writer(csv_file, lineterminator="\n")
+            writer.writerow(columns)
+            for n, row in enumerate(cursor):
+                # Convert bytes to strings, only in columns that have any
+                if blob_cols:
+                    row = list(row)
+                    for i in blob_cols:
+                        if isinstance(row[i], (bytes, bytearray)):
+                            row[i] = row[i].decode('utf-8', errors='replace')
+                writer.writerow(row)
+
+                # Add to this table's part of the combined JSON
+                record = orjson.dumps(dict(zip(columns, row)))
+                fragment.write((b",\n    " if n else b"\n    ") + record)
+        fragment.write(b"\n  ]")
+
+        print(f"📁 Saved table '{table}' → {csv_path}")
+        fragment.seek(0)
+        return fragment
+
+    except Exception as e:
+        fragment.close()
+        print(f"⚠️ Could not read table {table}: {e}")
+        return None
+
+    finally:
+        conn.close()
 
 def extract_dcf_to_files(dcf_path, output_dir="output"):
     # Create output folders
@@ -17,38 +77,26 @@ def extract_dcf_to_files(dcf_path, output_dir="output"):
     # Fetch all table names
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = [row[0] for row in cursor.fetchall()]
+    conn.close()
 
     print(f"✅ Found {len(tables)} tables in {dcf_path}")
 
-    all_data = {}  # To collect everything for JSON
-
-    # Loop through tables
-    for table in tables:
-        try:
-            df = pd.read_sql_query(f"SELECT * FROM '{table}';", conn)
-            # Convert bytes to strings if needed
-            for col in df.columns:
-                if df[col].dtype == object:
-                    df[col] = df[col].apply(lambda x: x.decode('utf-8', errors='replace')
-                                            if isinstance(x, (bytes, bytearray)) else x)
-
-            # Save each table as CSV
-            csv_path = os.path.join(csv_dir, f"{table}.csv")
-            df.to_csv(csv_path, index=False)
-            print(f"📁 Saved table '{table}' → {csv_path}")
-
-            # Add to combined JSON structure
-            all_data[table] = df.to_dict(orient="records")
-
-        except Exception as e:
-            print(f"⚠️ Could not read table {table}: {e}")
-
-    conn.close()
-
-    # Save all data to a single JSON file
+    # Tables are exported in parallel, each streaming its rows into its CSV
+    # and a temporary JSON fragment; the fragments are then joined in table order
     json_path = os.path.join(json_dir, "dcf_full_export.json")
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(all_data, f, ensure_ascii=False, indent=2)
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor, open(json_path, "wb") as json_file:
+        fragments = executor.map(lambda table: export_table(dcf_path, table, csv_dir), tables)
+
+        json_file.write(b"{")
+        first_table = True
+        for table, fragment in zip(tables, fragments):
+            if fragment is None:
+                continue
+            with fragment:
+                json_file.write((b"\n  " if first_table else b",\n  ") + orjson.dumps(table) + b": ")
+                shutil.copyfileobj(fragment, json_file)
+            first_table = False
+        json_file.write(b"\n}\n")
 
     print(f"\n✅ All CSV files saved in: {csv_dir}")
     print(f"✅ Combined JSON saved as: {json_path}")
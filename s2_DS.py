@@ -1,24 +1,39 @@
 import pandas as pd
-import json
-import re
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import orjson
+from collections import defaultdict, deque
+
+# Encoding artifacts and whitespace runs, collapsed to one space (RE2 syntax for pyarrow;
+# the extra classes cover what Python's \s matches beyond RE2's)
+ARROW_CLEAN_PATTERN = r'(?:Âḟ|[ÂḞ±°\s\v\x1c-\x1f\x{85}\pZ])+'
 
 def extract_complete_pipeline_flows(csv_file_path):
-    # Read the pipeline CSV file
-    df_pipelines = pd.read_csv(csv_file_path)
+    # Read only the needed columns of the pipeline CSV file, as text
+    table = pa_csv.read_csv(
+        csv_file_path,
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            include_columns=['Tag', 'From', 'To'],
+            column_types={'Tag': pa.string(), 'From': pa.string(), 'To': pa.string()},
+            strings_can_be_null=True,
+        ),
+    )
+    
+    # Clean the data and remove problematic characters, vectorized in Arrow;
+    # empty / NaN cells become ""
+    cleaned = {'Tag': pc.utf8_trim_whitespace(table.column('Tag'))}
+    for col in ['From', 'To']:
+        cleaned[col] = pc.utf8_trim_whitespace(
+            pc.replace_substring_regex(table.column(col), ARROW_CLEAN_PATTERN, ' ')
+        )
+    df_pipelines = pa.table({col: pc.fill_null(arr, '') for col, arr in cleaned.items()}).to_pandas()
     
     print("🔄 Reading pipeline data...")
     print(f"Total rows in CSV: {len(df_pipelines)}")
     print(f"Unique pipeline tags: {len(df_pipelines['Tag'].unique())}")
     
-    # Clean the data
-    df_pipelines['From'] = df_pipelines['From'].astype(str).str.strip()
-    df_pipelines['To'] = df_pipelines['To'].astype(str).str.strip()
-    df_pipelines['Tag'] = df_pipelines['Tag'].astype(str).str.strip()
-    
-    # Remove problematic characters
-    df_pipelines['From'] = df_pipelines['From'].apply(clean_text)
-    df_pipelines['To'] = df_pipelines['To'].apply(clean_text)
-    
     # Dictionary to store all pipeline flows
     pipeline_flows = {}
     
@@ -81,74 +96,61 @@ def build_flow_by_following_sequence(connections):
         return [connections[0]['from'], connections[0]['to']]
     
     # Start with the first connection
-    flow = [connections[0]['from'], connections[0]['to']]
-    used_connections = [0]  # Track which connections we've used
+    flow = deque([connections[0]['from'], connections[0]['to']])
+    used = bytearray(len(connections))  # Track which connections we've used
+    used[0] = 1
+    used_count = 1
+    
+    # Index connections by the nodes they touch, in original order
+    by_node = defaultdict(deque)
+    for i, conn in enumerate(connections):
+        by_node[conn['from']].append(i)
+        if conn['to'] != conn['from']:
+            by_node[conn['to']].append(i)
+    
+    def next_unused(node):
+        """Pop the lowest-index unused connection touching node, or None"""
+        candidates = by_node.get(node)
+        while candidates:
+            i = candidates.popleft()
+            if not used[i]:
+                return i
+        return None
     
     # Continue building the flow until all connections are used
-    while len(used_connections) < len(connections):
-        found_extension = False
-        
+    while used_count < len(connections):
         # Try to extend from the end
         last_node = flow[-1]
-        for i, conn in enumerate(connections):
-            if i not in used_connections:
-                if conn['from'] == last_node:
-                    flow.append(conn['to'])
-                    used_connections.append(i)
-                    found_extension = True
-                    break
-                elif conn['to'] == last_node:
-                    flow.append(conn['from'])
-                    used_connections.append(i)
-                    found_extension = True
-                    break
+        i = next_unused(last_node)
+        if i is not None:
+            conn = connections[i]
+            flow.append(conn['to'] if conn['from'] == last_node else conn['from'])
+            used[i] = 1
+            used_count += 1
+            continue
         
         # If couldn't extend from end, try to prepend from start
-        if not found_extension:
-            first_node = flow[0]
-            for i, conn in enumerate(connections):
-                if i not in used_connections:
-                    if conn['to'] == first_node:
-                        flow.insert(0, conn['from'])
-                        used_connections.append(i)
-                        found_extension = True
-                        break
-                    elif conn['from'] == first_node:
-                        flow.insert(0, conn['to'])
-                        used_connections.append(i)
-                        found_extension = True
-                        break
+        first_node = flow[0]
+        i = next_unused(first_node)
+        if i is not None:
+            conn = connections[i]
+            flow.appendleft(conn['from'] if conn['to'] == first_node else conn['to'])
+            used[i] = 1
+            used_count += 1
+            continue
         
         # If still no extension found, add remaining connections as disconnected segments
-        if not found_extension:
-            for i, conn in enumerate(connections):
-                if i not in used_connections:
-                    # Add this disconnected connection
-                    if conn['from'] not in flow:
-                        flow.append(conn['from'])
-                    if conn['to'] not in flow:
-                        flow.append(conn['to'])
-                    used_connections.append(i)
-            break
-    
-    return flow
-
-def clean_text(text):
-    """Clean text from encoding issues"""
-    if pd.isna(text) or text == 'nan':
-        return ""
-    
-    text = str(text)
-    # Remove encoding artifacts but keep the structure
-    text = re.sub(r'Âḟ', ' ', text)
-    text = re.sub(r'Â', ' ', text)
-    text = re.sub(r'Ḟ', ' ', text)
-    text = re.sub(r'±', ' ', text)
-    text = re.sub(r'°', ' ', text)
-    text = re.sub(r'\s+', ' ', text)
-    text = text.replace('\n', ' ').replace('\r', ' ')
-    
-    return text.strip()
+        seen = set(flow)
+        for i, conn in enumerate(connections):
+            if not used[i]:
+                # Add this disconnected connection
+                for node in (conn['from'], conn['to']):
+                    if node not in seen:
+                        flow.append(node)
+                        seen.add(node)
+        break
+    
+    return list(flow)
 
 def save_flows_to_json(pipeline_flows, output_file):
     """Save the pipeline flows to JSON file"""
@@ -165,8 +167,8 @@ def save_flows_to_json(pipeline_flows, output_file):
             "all_connections": data['all_raw_connections']
         }
     
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(json_output, f, indent=2, ensure_ascii=False)
+    with open(output_file, 'wb') as f:
+        f.write(orjson.dumps(json_output, option=orjson.OPT_INDENT_2))
     
     print(f"\n✅ Pipeline flows saved to: {output_file}")
     return json_output
@@ -1,12 +1,18 @@
 import sqlite3
-import json
-import pandas as pd
+import orjson
 import os
+from pathlib import Path
+from s1_extract import find_blob_columns
+
+# Rows fetched per batch when reading DCF tables
+FETCH_BATCH_SIZE = 10000
+
+# Tables whose rows are written to process_data
+PROCESS_DATA_TABLES = ("Equipment", "Instrumentation", "HandValves")
 
 def merge_pid_core(dcf_path, flow_json_path, output_file="merged_pid_core.json"):
     # Step 1: Load the flow file
-    with open(flow_json_path, "r", encoding="utf-8") as f:
-        flow_data = json.load(f)
+    flow_data = orjson.loads(Path(flow_json_path).read_bytes())
     print(f"✅ Loaded flow data → {len(flow_data)} pipelines")
 
     # Step 2: Connect to the DCF SQLite database
@@ -15,12 +21,8 @@ def merge_pid_core(dcf_path, flow_json_path, output_file="merged_pid_core.json")
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = [row[0] for row in cursor.fetchall()]
 
-    # Step 3: Find target tables (case-insensitive)
-    target_tables = []
-    for name in tables:
-        lower_name = name.lower()
-        if "equip" in lower_name or "instr" in lower_name or "handvalve" in lower_name:
-            target_tables.append(name)
+    # Step 3: Find the target tables that feed process_data
+    target_tables = [t for t in tables if t in PROCESS_DATA_TABLES]
 
     print(f"🔍 Found {len(target_tables)} relevant tables: {target_tables}")
 
@@ -28,22 +30,29 @@ def merge_pid_core(dcf_path, flow_json_path, output_file="merged_pid_core.json")
     extracted_data = {}
     for table in target_tables:
         try:
-            df = pd.read_sql_query(f"SELECT * FROM '{table}';", conn)
-            # Decode bytes if needed
-            for col in df.columns:
-                if df[col].dtype == object:
-                    df[col] = df[col].apply(
-                        lambda x: x.decode("utf-8", errors="replace")
-                        if isinstance(x, (bytes, bytearray))
-                        else x
-                    )
+            blob_cols = find_blob_columns(cursor, table)
+            cursor.execute(f"SELECT * FROM '{table}';")
+            columns = [d[0] for d in cursor.description]
 
             # 🟢 Rename 'Area' → 'Details' in Instrumentation table
             if "instr" in table.lower():
-                df = df.rename(columns={"Area": "Details"})
+                columns = ["Details" if c == "Area" else c for c in columns]
+
+            # Build the records straight from the cursor in batches
+            records = []
+            cursor.arraysize = FETCH_BATCH_SIZE
+            while batch := cursor.fetchmany():
+                # Convert bytes to strings, only in columns that have any
+                if blob_cols:
+                    batch = [list(row) for row in batch]
+                    for row in batch:
+                        for i in blob_cols:
+                            if isinstance(row[i], (bytes, bytearray)):
+                                row[i] = row[i].decode("utf-8", errors="replace")
+                records.extend(dict(zip(columns, row)) for row in batch)
 
-            extracted_data[table] = df.to_dict(orient="records")
-            print(f"📦 Extracted {len(df)} rows from {table}")
+            extracted_data[table] = records
+            print(f"📦 Extracted {len(records)} rows from {table}")
         except Exception as e:
             print(f"⚠️ Could not read {table}: {e}")
 
@@ -53,15 +62,13 @@ def merge_pid_core(dcf_path, flow_json_path, output_file="merged_pid_core.json")
     merged_data = {
         "complete_pipeline_flows": flow_data,
         "process_data": {
-            "Equipment": extracted_data.get("Equipment", []),
-            "Instrumentation": extracted_data.get("Instrumentation", []),
-            "HandValves": extracted_data.get("HandValves", [])
+            name: extracted_data.get(name, []) for name in PROCESS_DATA_TABLES
         }
     }
 
-    # Step 6: Save the merged result
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(merged_data, f, ensure_ascii=False, indent=2)
+    # Step 6: Save the merged result (intermediate file read back by s4, so no indentation)
+    with open(output_file, "wb") as f:
+        f.write(orjson.dumps(merged_data))
 
     print(f"\n✅ Final merged JSON saved → {output_file}")
     print(f"✅ Includes: Equipment + Instrumentation (Area→Details) + HandValves")
@@ -1,55 +1,54 @@
-import json
+import orjson
 import re
 import os
+from pathlib import Path
+
+_NON_ALNUM_RE = re.compile(r'[^a-zA-Z0-9]')
 
 def normalize_tag(tag):
     """Clean and unify tag names: remove non-alphanumeric characters and lowercase."""
     if not isinstance(tag, str):
         return tag
-    return re.sub(r'[^a-zA-Z0-9]', '', tag).lower()
+    return _NON_ALNUM_RE.sub('', tag).lower()
 
 def normalize_merged_pid(input_json_path, output_path="normalized_merged_pid.json"):
     # Load JSON file
-    with open(input_json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = orjson.loads(Path(input_json_path).read_bytes())
 
     # Get all pipeline tags so we can skip normalization for them
     all_pipeline_tags = set(data.get("complete_pipeline_flows", {}).keys())
     print(f"🔍 Found {len(all_pipeline_tags)} pipeline tags. They will NOT be normalized.")
 
-    # Helper: recursively normalize everything except pipeline tags
-    def recursive_normalize(obj, skip_keys=("pipeline_tag",)):
-        if isinstance(obj, dict):
-            new_obj = {}
-            for k, v in obj.items():
-                # Skip keys like "pipeline_tag"
-                if k in skip_keys:
-                    new_obj[k] = v
-                    continue
-                # Normalize strings unless they are known pipeline tags
-                if isinstance(v, str):
-                    if v in all_pipeline_tags:
-                        new_obj[k] = v  # leave it as-is
-                    else:
-                        new_obj[k] = normalize_tag(v)
-                else:
-                    new_obj[k] = recursive_normalize(v, skip_keys)
-            return new_obj
-
-        elif isinstance(obj, list):
-            new_list = []
-            for item in obj:
-                if isinstance(item, str):
-                    if item in all_pipeline_tags:
-                        new_list.append(item)  # keep pipeline tag
-                    else:
-                        new_list.append(normalize_tag(item))
-                else:
-                    new_list.append(recursive_normalize(item, skip_keys))
-            return new_list
-
-        else:
-            return obj
+    # Memoized normalization; pipeline tags map to themselves so they are left as-is
+    norm_cache = {tag: tag for tag in all_pipeline_tags}
+
+    def norm(value):
+        result = norm_cache.get(value)
+        if result is None:
+            result = norm_cache[value] = normalize_tag(value)
+        return result
+
+    # Helper: normalize everything in place except pipeline tags, walking with an explicit stack
+    def normalize_in_place(obj, skip_keys=("pipeline_tag",)):
+        stack = [obj]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, dict):
+                for k, v in node.items():
+                    # Skip keys like "pipeline_tag"
+                    if k in skip_keys:
+                        continue
+                    if isinstance(v, str):
+                        node[k] = norm(v)
+                    elif isinstance(v, (dict, list)):
+                        stack.append(v)
+            elif isinstance(node, list):
+                for i, v in enumerate(node):
+                    if isinstance(v, str):
+                        node[i] = norm(v)
+                    elif isinstance(v, (dict, list)):
+                        stack.append(v)
+        return obj
 
     # ------------------------------
     # Normalize only non-pipeline tags
@@ -59,7 +58,7 @@ def normalize_merged_pid(input_json_path, output_path="normalized_merged_pid.jso
 
     for pipe_tag, pipe_info in flow_data.items():
         # Keep pipeline tag original
-        normalized_flows[pipe_tag] = recursive_normalize(pipe_info, skip_keys=("pipeline_tag",))
+        normalized_flows[pipe_tag] = normalize_in_place(pipe_info, skip_keys=("pipeline_tag",))
 
     # ------------------------------
     # Normalize process_data tags
@@ -67,15 +66,12 @@ def normalize_merged_pid(input_json_path, output_path="normalized_merged_pid.jso
     process_data = data.get("process_data", {})
 
     def normalize_tag_in_records(records, tag_field="Tag"):
-        new_records = []
+        # Records were just loaded from disk, so they are updated in place rather than copied
         for rec in records:
-            rec_copy = dict(rec)
-            if tag_field in rec_copy:
-                tag_value = rec_copy[tag_field]
-                if isinstance(tag_value, str) and tag_value not in all_pipeline_tags:
-                    rec_copy[tag_field] = normalize_tag(tag_value)
-            new_records.append(rec_copy)
-        return new_records
+            tag_value = rec.get(tag_field)
+            if isinstance(tag_value, str):
+                rec[tag_field] = norm(tag_value)
+        return records
 
     if "Equipment" in process_data:
         process_data["Equipment"] = normalize_tag_in_records(process_data["Equipment"])
@@ -92,8 +88,9 @@ def normalize_merged_pid(input_json_path, output_path="normalized_merged_pid.jso
         "process_data": process_data
     }
 
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(normalized_json, f, ensure_ascii=False, indent=2)
+    # Intermediate file read back by s5, so no indentation
+    with open(output_path, "wb") as f:
+        f.write(orjson.dumps(normalized_json))
 
     print("✅ Normalization complete.")
     print("✅ All tags normalized except any pipeline tag (wherever found).")
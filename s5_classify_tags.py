@@ -1,124 +1,269 @@
-import json
-from difflib import SequenceMatcher
+import itertools
+import os
+import sys
+import threading
+import numpy as np
+import orjson
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from rapidfuzz import fuzz, process
 
-def similarity(a, b):
-    """Compute similarity ratio between two strings."""
-    return SequenceMatcher(None, a, b).ratio()
+# A process pool is only used when asked for (workers > 1), more than one CPU is available
+# and the plant has at least this many pipelines; otherwise it only adds startup and pickling cost
+PARALLEL_MIN_PIPELINES = 500
 
-def classify_tags_preserve_flow(json_path, output_file="classified_pipeline_tags.json", threshold=0.6):
+# Read-only reference data for classification, set once per process by init_classifier
+# (in each pool worker, or in the calling process for the duration of an in-process run)
+_index = None
+_threshold = 0.6
+_match_cache = {}
+
+# Serializes in-process runs, which share the module state above
+_in_process_lock = threading.Lock()
+
+class ClassifierIndex:
+    """Lookup structures for classifying tags of one plant; build once and reuse across calls."""
+    __slots__ = ("pipelines", "references", "ref_index", "ref_keys", "ref_bounds")
+
+    def __init__(self, process_data, pipelines):
+        # All known pipeline tags, to detect them
+        self.pipelines = frozenset(pipelines)
+
+        equipment = process_data.get("Equipment", [])
+        instruments = process_data.get("Instrumentation", [])
+        handvalves = process_data.get("HandValves", [])
+
+        # Keys are interned so lookups against the same tag string short-circuit on identity
+        equipment_tags = {sys.intern(str(e.get("Tag", "")).lower()): e for e in equipment}
+        instrument_tags = {sys.intern(str(i.get("Tag", "")).lower()): i for i in instruments}
+        handvalve_tags = {sys.intern(str(h.get("Tag", "")).lower()): h for h in handvalves}
+
+        # Reference tag tuples per category, built once for batch scoring
+        self.references = (
+            ("equipment", equipment_tags, tuple(equipment_tags)),
+            ("instrumentation", instrument_tags, tuple(instrument_tags)),
+            ("handvalve", handvalve_tags, tuple(handvalve_tags)),
+        )
+
+        # One exact-match lookup across categories; on collisions the earlier category wins
+        # (equipment > instrumentation > handvalve), as in the fuzzy path
+        self.ref_index = {}
+        for cat_name, tag_dict, _ in self.references:
+            for tag, details in tag_dict.items():
+                self.ref_index.setdefault(tag, (cat_name, details))
+
+        # All reference tags in category order, plus the end index of each category within that list
+        self.ref_keys = [k for _, _, ref_tags in self.references for k in ref_tags]
+        self.ref_bounds = list(itertools.accumulate(len(ref_tags) for _, _, ref_tags in self.references))
+
+def init_classifier(index, threshold=0.6):
+    """Store the shared reference data in module globals; required before find_best_match/match_process_data."""
+    global _index, _threshold
+    _index = index
+    _threshold = threshold
+    _match_cache.clear()
+
+def reset_classifier():
+    """Drop the reference data and match cache, so no plant stays in memory after a run."""
+    init_classifier(None)
+
+def _available_cpus():
+    """CPUs this process may run on (affinity / container limits), where the platform reports it."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def find_best_match(tag):
+    """Find best match and category for a tag (equipment, instrumentation, handvalve, pipeline, or node)."""
+    if not isinstance(tag, str) or not tag.strip():
+        return {"category": "node", "details": None, "score": 0}
+    if _index is None:
+        raise RuntimeError("No ClassifierIndex set; call init_classifier(index) first")
+
+    tag_lower = sys.intern(tag.lower().strip())
+
+    # ✅ Direct match with pipeline tags
+    if tag in _index.pipelines:  # exact match to pipeline
+        return {"category": "pipeline", "details": None, "score": 1.0}
+
+    return match_process_data(tag_lower)
+
+def match_process_data(tag_lower):
+    """Match a lowercased tag against process data; memoized, as tags recur across pipelines."""
+    match = _match_cache.get(tag_lower)
+    if match is None:
+        if _index is None:
+            raise RuntimeError("No ClassifierIndex set; call init_classifier(index) first")
+        match = _exact_match(tag_lower)
+        if match is None:
+            _fuzzy_match_batch([tag_lower])
+            return _match_cache[tag_lower]
+        _match_cache[tag_lower] = match
+    return match
+
+def _exact_match(tag_lower):
+    """✅ Exact match with process data (the common case after normalization)."""
+    hit = _index.ref_index.get(tag_lower)
+    if hit is None:
+        return None
+    return {"category": hit[0], "details": hit[1], "score": 1.0}
+
+def _fuzzy_match_batch(queries):
+    """✅ Fuzzy match queries against all process data tags in one cdist call and cache the results."""
+    # fuzz.ratio is 2*LCS/(len(a)+len(b)), never lower than the difflib SequenceMatcher.ratio()
+    # these tags used to be scored with, so a few near misses now clear the threshold
+    # (e.g. '9ig202' vs '9g0x2o': 0.50 -> 0.67, 'boaogf' vs 'ayof': 0.40 -> 0.60)
+    cutoff = _threshold * 100
+    ref_keys = _index.ref_keys
+    if not ref_keys:
+        for tag_lower in queries:
+            _match_cache[tag_lower] = {"category": "node", "details": None, "score": 0}
+        return
+
+    # float64 keeps the scores exactly as fuzz.ratio returns them, so the threshold test is unchanged.
+    # With score_cutoff, pairs whose length difference already rules out the threshold are skipped
+    # without running the comparison, and score 0.
+    scores = process.cdist(
+        queries, ref_keys, scorer=fuzz.ratio, dtype=np.float64, workers=1, score_cutoff=cutoff
+    )
+    # argmax takes the first maximum: earlier category wins ties, then earlier tag within it
+    best_idx = scores.argmax(axis=1)
+    best_scores = scores[np.arange(len(queries)), best_idx]
+    # Category of every best hit, looked up for the whole batch at once
+    cat_idx = np.searchsorted(_index.ref_bounds, best_idx, side="right")
+
+    for tag_lower, idx, score, cat in zip(queries, best_idx.tolist(), best_scores.tolist(), cat_idx.tolist()):
+        # Apply threshold to accept fuzzy match; a zero score is never a match, even at threshold 0
+        if score > 0 and score >= cutoff:
+            cat_name, tag_dict, _ = _index.references[cat]
+            match = {"category": cat_name, "details": tag_dict[ref_keys[idx]], "score": score / 100}
+        else:
+            match = {"category": "node", "details": None, "score": 0}
+        _match_cache[tag_lower] = match
+
+def _prefetch_fuzzy_matches(pipe_info):
+    """Score every not yet cached, non-exact tag of one pipeline with a single batched call."""
+    tags = [pipe_info.get("start"), pipe_info.get("end")]
+    if isinstance(pipe_info.get("complete_flow"), list):
+        tags.extend(pipe_info["complete_flow"])
+    if isinstance(pipe_info.get("all_connections"), list):
+        for conn in pipe_info["all_connections"]:
+            tags.append(conn.get("from"))
+            tags.append(conn.get("to"))
+
+    queries = {}
+    for tag in tags:
+        if not isinstance(tag, str) or not tag.strip() or tag in _index.pipelines:
+            continue
+        tag_lower = sys.intern(tag.lower().strip())
+        if tag_lower in _match_cache or tag_lower in queries:
+            continue
+        match = _exact_match(tag_lower)
+        if match is None:
+            queries[tag_lower] = None
+        else:
+            _match_cache[tag_lower] = match
+
+    if queries:
+        _fuzzy_match_batch(list(queries))
+
+def _classify_pipeline(item):
+    """Enrich one (pipe_tag, pipe_info) pair, using the reference data set by init_classifier."""
+    pipe_tag, pipe_info = item
+
+    # Shallow copy is enough: only top-level keys are replaced below, nested values are never mutated
+    new_pipe = dict(pipe_info)
+    _prefetch_fuzzy_matches(new_pipe)
+
+    # Enrich 'start' and 'end'
+    for key in ["start", "end"]:
+        if key in new_pipe and new_pipe[key]:
+            tag = new_pipe[key]
+            match = find_best_match(tag)
+            new_pipe[key] = {
+                "tag": tag,
+                "category": match["category"],
+                "details": match["details"]
+            }
+
+    # Enrich 'complete_flow'
+    if "complete_flow" in new_pipe and isinstance(new_pipe["complete_flow"], list):
+        enriched_flow = []
+        for tag in new_pipe["complete_flow"]:
+            match = find_best_match(tag)
+            enriched_flow.append({
+                "tag": tag,
+                "category": match["category"],
+                "details": match["details"]
+            })
+        new_pipe["complete_flow"] = enriched_flow
+
+    # Enrich 'all_connections'
+    if "all_connections" in new_pipe and isinstance(new_pipe["all_connections"], list):
+        enriched_connections = []
+        for conn in new_pipe["all_connections"]:
+            from_tag = conn.get("from")
+            to_tag = conn.get("to")
+
+            from_match = find_best_match(from_tag)
+            to_match = find_best_match(to_tag)
+
+            enriched_connections.append({
+                "from": {
+                    "tag": from_tag,
+                    "category": from_match["category"],
+                    "details": from_match["details"]
+                },
+                "to": {
+                    "tag": to_tag,
+                    "category": to_match["category"],
+                    "details": to_match["details"]
+                }
+            })
+        new_pipe["all_connections"] = enriched_connections
+
+    return pipe_tag, new_pipe
+
+def classify_tags_preserve_flow(json_path, output_file="classified_pipeline_tags.json", threshold=0.6, index=None,
+                                workers=1):
     # Step 1: Load normalized merged JSON
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    data = orjson.loads(Path(json_path).read_bytes())
 
     flow_data = data.get("complete_pipeline_flows", {})
     process_data = data.get("process_data", {})
 
-    # Step 2: Gather all known pipeline tags to detect them
-    all_pipeline_tags = set(flow_data.keys())
-    print(f"🔍 Found {len(all_pipeline_tags)} pipeline tags (will be categorized as 'pipeline').")
-
-    # Step 3: Prepare lookup dictionaries for process_data
-    equipment = process_data.get("Equipment", [])
-    instruments = process_data.get("Instrumentation", [])
-    handvalves = process_data.get("HandValves", [])
-
-    equipment_tags = {str(e.get("Tag", "")).lower(): e for e in equipment}
-    instrument_tags = {str(i.get("Tag", "")).lower(): i for i in instruments}
-    handvalve_tags = {str(h.get("Tag", "")).lower(): h for h in handvalves}
-
-    def find_best_match(tag):
-        """Find best match and category for a tag (equipment, instrumentation, handvalve, pipeline, or node)."""
-        if not isinstance(tag, str) or not tag.strip():
-            return {"category": "node", "details": None, "score": 0}
-
-        tag_lower = tag.lower().strip()
-
-        # ✅ Direct match with pipeline tags
-        for p_tag in all_pipeline_tags:
-            if tag == p_tag:  # exact match to pipeline
-                return {"category": "pipeline", "details": None, "score": 1.0}
-
-        # ✅ Fuzzy match check with process data
-        best = {"category": "node", "details": None, "score": 0}
-        for cat_name, tag_dict in [
-            ("equipment", equipment_tags),
-            ("instrumentation", instrument_tags),
-            ("handvalve", handvalve_tags),
-        ]:
-            for ref_tag, details in tag_dict.items():
-                score = similarity(tag_lower, ref_tag)
-                if score > best["score"]:
-                    best = {"category": cat_name, "details": details, "score": score}
-
-        # Apply threshold to accept fuzzy match
-        if best["score"] >= threshold:
-            return best
-        return {"category": "node", "details": None, "score": best["score"]}
-
-    # Step 4: Create a deep copy of flow data and enrich it
-    classified_flows = {}
-
-    for pipe_tag, pipe_info in flow_data.items():
-        # Copy the structure exactly
-        new_pipe = json.loads(json.dumps(pipe_info))
-
-        # Enrich 'start' and 'end'
-        for key in ["start", "end"]:
-            if key in new_pipe and new_pipe[key]:
-                tag = new_pipe[key]
-                match = find_best_match(tag)
-                new_pipe[key] = {
-                    "tag": tag,
-                    "category": match["category"],
-                    "details": match["details"]
-                }
+    # Step 2: Build lookup structures for pipeline tags and process_data, unless a prebuilt index is given
+    if index is None:
+        index = ClassifierIndex(process_data, flow_data.keys())
+    print(f"🔍 Found {len(index.pipelines)} pipeline tags (will be categorized as 'pipeline').")
+
+    # Step 3: Copy flow data and enrich it, one pipeline per task (across worker processes if requested)
+    workers = min(workers, _available_cpus())
+    if workers > 1 and len(flow_data) >= PARALLEL_MIN_PIPELINES:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=init_classifier,
+            initargs=(index, threshold),
+        ) as ex:
+            classified_flows = dict(ex.map(_classify_pipeline, flow_data.items(), chunksize=16))
+    else:
+        with _in_process_lock:
+            init_classifier(index, threshold)
+            try:
+                classified_flows = dict(map(_classify_pipeline, flow_data.items()))
+            finally:
+                reset_classifier()
 
-        # Enrich 'complete_flow'
-        if "complete_flow" in new_pipe and isinstance(new_pipe["complete_flow"], list):
-            enriched_flow = []
-            for tag in new_pipe["complete_flow"]:
-                match = find_best_match(tag)
-                enriched_flow.append({
-                    "tag": tag,
-                    "category": match["category"],
-                    "details": match["details"]
-                })
-            new_pipe["complete_flow"] = enriched_flow
-
-        # Enrich 'all_connections'
-        if "all_connections" in new_pipe and isinstance(new_pipe["all_connections"], list):
-            enriched_connections = []
-            for conn in new_pipe["all_connections"]:
-                from_tag = conn.get("from")
-                to_tag = conn.get("to")
-
-                from_match = find_best_match(from_tag)
-                to_match = find_best_match(to_tag)
-
-                enriched_connections.append({
-                    "from": {
-                        "tag": from_tag,
-                        "category": from_match["category"],
-                        "details": from_match["details"]
-                    },
-                    "to": {
-                        "tag": to_tag,
-                        "category": to_match["category"],
-                        "details": to_match["details"]
-                    }
-                })
-            new_pipe["all_connections"] = enriched_connections
-
-        classified_flows[pipe_tag] = new_pipe
-
-    # Step 5: Combine with process_data and save
+    # Step 4: Combine with process_data and save
     final_output = {
         "complete_pipeline_flows": classified_flows,
         "process_data": process_data
     }
 
-    with open(output_file, "w", encoding="utf-8") as f:
-        json.dump(final_output, f, ensure_ascii=False, indent=2)
+    # Machine-consumed by the Streamlit app, so written compact in one call
+    with open(output_file, "wb") as f:
+        f.write(orjson.dumps(final_output))
 
     print(f"✅ Classified tags added → {output_file}")
     print("✅ Flow structure preserved exactly as in normalized_merged_pid.json")